@@ -0,0 +1,72 @@
+"""
+Pieces shared by the JunoCam mosaic scripts (main.py, main_with_spice.py).
+"""
+
+import cv2
+import numpy as np
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Decoded raw images and SPICE-derived pixel offsets are cached here between runs
+CACHE_DIR = Path(".cache")
+
+# Intermediate single-channel PNGs favour encode speed over file size
+FAST_PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+
+def stretch_to_bgr8(blue, green, red):
+    """
+    Stack three channel mosaics into an 8-bit BGR image (OpenCV order).
+
+    Each channel is stretched to 0..255 independently with one min/max
+    reduction and one fused rescale.
+
+    Args:
+        blue: Blue channel mosaic
+        green: Green channel mosaic
+        red: Red channel mosaic
+
+    Returns:
+        (rows, cols, 3) uint8 BGR image
+    """
+    bgr = np.stack([blue, green, red], axis=-1)
+    lo = bgr.min(axis=(0, 1), keepdims=True)
+    hi = bgr.max(axis=(0, 1), keepdims=True)
+    scale = np.float32(255.0) / np.maximum(hi - lo, 1).astype(np.float32)
+    if bgr.dtype != np.uint8:
+        return ((bgr - lo) * scale + np.float32(0.5)).astype(np.uint8)
+    if (lo == 0).all() and (hi == 255).all():
+        # Already full-range 8-bit: the stretch is the identity
+        return bgr
+    # 8-bit input: apply the same stretch as a per-channel lookup table
+    levels = np.arange(256, dtype=np.float32).reshape(256, 1, 1)
+    lut = np.clip((levels - lo) * scale + np.float32(0.5), 0, 255).astype(np.uint8)
+    return cv2.LUT(bgr, lut)
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Open a temporary file for binary writing and move it onto path on success.
+
+    An interrupted write leaves no truncated file at path, so cache readers
+    never see a partial entry.
+
+    Args:
+        path: Final file path
+
+    Yields:
+        Binary file object to write to
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
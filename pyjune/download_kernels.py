@@ -34,9 +34,12 @@ Download the following kernels to the respective directories:
 Note: You'll need to find the specific SPK and CK files that cover your date range.
 """
 
-import urllib.request
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import urllib3
+
 # Base URL for Juno kernels (PDS archive)
 BASE_URL = "https://naif.jpl.nasa.gov/pub/naif/pds/data/jno-j_e_ss-spice-6-v1.0/jnosp_1000/data/"
 
@@ -46,6 +49,9 @@ STATIC_KERNELS = {
     "pck/pck00011.tpc": "kernels/pck/pck00011.tpc",
 }
 
+# Shared connection pool so every download reuses the same TLS connections
+http = urllib3.PoolManager(maxsize=8, retries=urllib3.Retry(total=3, backoff_factor=0.5))
+
 def download_kernel(url, dest):
     """Download a kernel file if it doesn't exist."""
     dest_path = Path(dest)
@@ -55,17 +61,32 @@ def download_kernel(url, dest):
 
     print(f"Downloading {url} -> {dest}")
     dest_path.parent.mkdir(parents=True, exist_ok=True)
-    urllib.request.urlretrieve(url, dest)
+    resp = http.request("GET", url, preload_content=False)
+    try:
+        if resp.status != 200:
+            raise urllib3.exceptions.HTTPError(f"HTTP {resp.status}")
+        # Stream to a temporary file so a failed download leaves no partial kernel
+        tmp_path = dest_path.with_name(dest_path.name + ".part")
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(resp, f, 1 << 20)
+        tmp_path.replace(dest_path)
+    finally:
+        resp.release_conn()
     print(f"Downloaded: {dest}")
 
+def download_one(item):
+    """Download a single (kernel_path, local_path) entry, reporting errors."""
+    kernel_path, local_path = item
+    url = BASE_URL + kernel_path
+    try:
+        download_kernel(url, local_path)
+    except Exception as e:
+        print(f"Error downloading {url}: {e}")
+
 def main():
     print("Downloading static SPICE kernels...")
-    for kernel_path, local_path in STATIC_KERNELS.items():
-        url = BASE_URL + kernel_path
-        try:
-            download_kernel(url, local_path)
-        except Exception as e:
-            print(f"Error downloading {url}: {e}")
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        list(ex.map(download_one, STATIC_KERNELS.items()))
 
     print("\n" + "="*60)
     print("Manual downloads needed:")
@@ -5,10 +5,14 @@ This script demonstrates the basic SPICE operations you'll need for
 JunoCam geometric correction.
 """
 
+import numpy as np
 import spiceypy as spice
+from spiceypy import cyice
 from pathlib import Path
 from datetime import datetime
 
+from spice_correction import write_metakernel
+
 
 def print_section(title):
     """Print a section header."""
@@ -46,13 +50,16 @@ def load_kernels():
 
     for kernel in kernels:
         if kernel.exists():
-            spice.furnsh(str(kernel))
-            loaded.append(kernel.name)
+            loaded.append(kernel)
             print(f"✓ Loaded: {kernel.name}")
         else:
             missing.append(kernel.name)
             print(f"✗ Missing: {kernel.name}")
 
+    # Furnish everything that was found through a single metakernel
+    if loaded:
+        spice.furnsh(str(write_metakernel(kernel_dir, loaded)))
+
     if missing:
         print(f"\nWarning: {len(missing)} kernel(s) not found.")
         print("Some examples below may not work without all kernels.")
@@ -73,17 +80,24 @@ def explore_time_conversions():
     print(f"\nUTC String: {utc_string}")
 
     try:
-        et = spice.str2et(utc_string)
+        et = cyice.str2et(utc_string)
         print(f"Ephemeris Time (ET): {et:.6f} seconds past J2000")
 
         # Convert back to calendar
-        calendar = spice.et2utc(et, "C", 0)
+        calendar = cyice.et2utc(et, "C", 0)
         print(f"Back to UTC: {calendar}")
 
         # Get Julian Date
-        jd = spice.et2utc(et, "J", 6)
+        jd = cyice.et2utc(et, "J", 6)
         print(f"Julian Date: {jd}")
 
+        # Many timestamps (one per frame, day, ...) convert in a single call
+        utc_list = [f"{year}-{d:03d}T12:00:00" for d in range(day - 1, day + 2)]
+        ets = cyice.str2et_v(np.array(utc_list))
+        print("\nVectorized conversion (one str2et_v call):")
+        for utc, et_day in zip(utc_list, ets):
+            print(f"  {utc} -> ET {et_day:.6f}")
+
     except Exception as e:
         print(f"Error: {e}")
         print("(LSK kernel required for time conversions)")
@@ -105,8 +119,8 @@ def explore_time_conversions():
 
     try:
         # Convert SCLK to ET (requires SCLK kernel)
-        et_from_sclk = spice.scs2e(-61, sclk_string)
-        utc_from_sclk = spice.et2utc(et_from_sclk, "C", 0)
+        et_from_sclk = cyice.scs2e(-61, sclk_string)
+        utc_from_sclk = cyice.et2utc(et_from_sclk, "C", 0)
         print(f"Converts to ET: {et_from_sclk:.6f}")
         print(f"Converts to UTC: {utc_from_sclk}")
     except Exception as e:
@@ -122,28 +136,35 @@ def explore_spacecraft_state():
     utc = "2022-02-25T12:00:00"
 
     try:
-        et = spice.str2et(utc)
+        et = cyice.str2et(utc)
         print(f"Query time: {utc}")
         print(f"ET: {et:.6f}\n")
 
-        # Get Juno's state relative to Jupiter
-        # spkezr returns: [x, y, z, vx, vy, vz] and light time
+        # Time between filter exposures, used for the motion calculation below
+        dt = 0.001  # 1 millisecond (approximate time between filters)
+
+        # Get Juno's state relative to Jupiter at both epochs in one call
+        # spkezr_v returns an (N, 6) array of [x, y, z, vx, vy, vz] and N light times
         print("Juno state relative to Jupiter (J2000 frame):")
-        state, lt = spice.spkezr(
+        ets = np.array([et, et + dt])
+        states, lts = cyice.spkezr_v(
             "JUNO",      # Target: Juno spacecraft
-            et,          # Time (ephemeris time)
+            ets,         # Times (ephemeris time)
             "J2000",     # Reference frame
             "NONE",      # Aberration correction
             "JUPITER"    # Observer: Jupiter
         )
+        state, lt = states[0], lts[0]
 
-        position = state[:3]  # km
-        velocity = state[3:]  # km/s
+        # View the state as (position, velocity) rows to get both norms at once
+        pv = np.asarray(state).reshape(2, 3)
+        position, velocity = pv  # km, km/s
+        range_km, speed_kms = np.linalg.norm(pv, axis=1)
 
         print(f"Position (km): [{position[0]:12.3f}, {position[1]:12.3f}, {position[2]:12.3f}]")
         print(f"Velocity (km/s): [{velocity[0]:9.6f}, {velocity[1]:9.6f}, {velocity[2]:9.6f}]")
-        print(f"Range (km): {spice.vnorm(position):12.3f}")
-        print(f"Speed (km/s): {spice.vnorm(velocity):9.6f}")
+        print(f"Range (km): {range_km:12.3f}")
+        print(f"Speed (km/s): {speed_kms:9.6f}")
         print(f"Light time (s): {lt:.6f}")
 
         # Calculate motion over a short interval (like between filter exposures)
@@ -151,12 +172,7 @@ def explore_spacecraft_state():
         print("Spacecraft motion during 1 millisecond:")
         print("-" * 70)
 
-        dt = 0.001  # 1 millisecond (approximate time between filters)
-
-        state_start, _ = spice.spkezr("JUNO", et, "J2000", "NONE", "JUPITER")
-        state_end, _ = spice.spkezr("JUNO", et + dt, "J2000", "NONE", "JUPITER")
-
-        displacement = state_end[:3] - state_start[:3]
+        displacement = states[1, :3] - states[0, :3]
 
         print(f"Time interval: {dt * 1000:.3f} milliseconds")
         print(f"Displacement (km): [{displacement[0]:.9f}, {displacement[1]:.9f}, {displacement[2]:.9f}]")
@@ -176,14 +192,13 @@ def explore_spacecraft_orientation():
     utc = "2022-02-25T12:00:00"
 
     try:
-        et = spice.str2et(utc)
+        et = cyice.str2et(utc)
         print(f"Query time: {utc}\n")
 
         # Get rotation matrix from J2000 to spacecraft frame
         print("Rotation matrix from J2000 to Juno spacecraft frame:")
 
-        # pxform returns a rotation matrix
-        rotation = spice.pxform("J2000", "JUNO_SPACECRAFT", et)
+        rotation = cyice.pxform("J2000", "JUNO_SPACECRAFT", et)
 
         print("Rotation matrix:")
         for i, row in enumerate(rotation):
@@ -198,7 +213,7 @@ def explore_spacecraft_orientation():
 
         # Try to get JunoCam frame
         try:
-            cam_rotation = spice.pxform("J2000", "JUNO_JUNOCAM", et)
+            cam_rotation = cyice.pxform("J2000", "JUNO_JUNOCAM", et)
             print("\nJunoCam frame is available!")
             print("This allows transforming from inertial to camera frame.")
         except:
@@ -220,18 +235,18 @@ def explore_coverage():
         # For now, we'll just try to query a specific time
 
         test_date = "2022-02-25T12:00:00"
-        et = spice.str2et(test_date)
+        et = cyice.str2et(test_date)
 
         print(f"\nTesting coverage for: {test_date}")
 
         try:
-            state, _ = spice.spkezr("JUNO", et, "J2000", "NONE", "JUPITER")
+            state, _ = cyice.spkezr("JUNO", et, "J2000", "NONE", "JUPITER")
             print("✓ SPK coverage: Data available for this date")
         except:
             print("✗ SPK coverage: No data for this date")
 
         try:
-            rotation = spice.pxform("J2000", "JUNO_SPACECRAFT", et)
+            rotation = cyice.pxform("J2000", "JUNO_SPACECRAFT", et)
             print("✓ CK coverage: Orientation data available")
         except:
             print("✗ CK coverage: No orientation data for this date")
@@ -251,32 +266,32 @@ def calculate_pixel_shift_example():
     utc = "2022-02-25T12:00:00"
 
     try:
-        et = spice.str2et(utc)
+        et = cyice.str2et(utc)
 
         # Time between filter exposures (approximate)
         dt = 0.001  # 1 millisecond
 
-        # Get spacecraft states
-        state_t0, _ = spice.spkezr("JUNO", et, "J2000", "NONE", "JUPITER")
-        state_t1, _ = spice.spkezr("JUNO", et + dt, "J2000", "NONE", "JUPITER")
+        # Get spacecraft states at both epochs in a single vectorized call
+        states, _ = cyice.spkezr_v(
+            "JUNO", np.array([et, et + dt]), "J2000", "NONE", "JUPITER"
+        )
 
         # Position and velocity
-        pos_t0 = state_t0[:3]
-        pos_t1 = state_t1[:3]
+        pos_t0 = states[0, :3]
+        pos_t1 = states[1, :3]
 
         # Displacement in km
         displacement_km = pos_t1 - pos_t0
-        displacement_m = displacement_km * 1000
 
-        # Range to Jupiter
-        range_km = spice.vnorm(pos_t0)
+        # Range to Jupiter and motion magnitude from one norm over both vectors
+        range_km, motion_km = np.linalg.norm(np.stack([pos_t0, displacement_km]), axis=1)
 
         print(f"Spacecraft range to Jupiter: {range_km:.1f} km")
-        print(f"Motion in {dt*1000:.1f} ms: {spice.vnorm(displacement_m):.6f} meters")
+        print(f"Motion in {dt*1000:.1f} ms: {motion_km * 1000:.6f} meters")
 
         # Calculate angular shift
         # For small angles: angle (rad) ≈ displacement / range
-        angular_shift_rad = spice.vnorm(displacement_km) / range_km
+        angular_shift_rad = motion_km / range_km
         angular_shift_urad = angular_shift_rad * 1e6  # microradians
 
         print(f"Angular shift: {angular_shift_urad:.3f} microradians")
@@ -3,6 +3,7 @@ Quick script to list all kernel files you have downloaded.
 Helps you update the kernel paths in other scripts.
 """
 
+import os
 from pathlib import Path
 
 
@@ -37,14 +38,16 @@ def list_kernels():
             print("  Directory not found")
             continue
 
-        files = sorted(kdir.glob("*"))
-        if not files:
+        # scandir entries carry cached file-type info, so only size needs a stat
+        with os.scandir(kdir) as it:
+            entries = [e for e in it if e.is_file()]
+        entries.sort(key=lambda e: e.name)
+        if not entries:
             print("  (empty)")
         else:
-            for f in files:
-                if f.is_file():
-                    size_kb = f.stat().st_size / 1024
-                    print(f"  ✓ {f.name} ({size_kb:.1f} KB)")
+            for e in entries:
+                size_kb = e.stat().st_size / 1024
+                print(f"  ✓ {e.name} ({size_kb:.1f} KB)")
 
     print("\n" + "=" * 70)
     print("\nTo use these kernels, update the paths in:")
@@ -1,15 +1,75 @@
 import cv2
+import hashlib
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
 
+from common import CACHE_DIR, FAST_PNG_PARAMS, atomic_write, stretch_to_bgr8
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def png_format(fname):
+    """
+    Read bit depth and color type from a PNG's IHDR chunk.
+
+    Returns:
+        Tuple of (bit_depth, color_type), or None if fname is not a PNG
+    """
+    with open(fname, "rb") as f:
+        header = f.read(26)
+    if len(header) < 26 or header[:8] != PNG_SIGNATURE:
+        return None
+    return header[24], header[25]
+
+
+def load_raw(fname):
+    """
+    Load a raw JunoCam image.
+
+    The first load decodes the PNG (as 8-bit grayscale when the file is
+    8-bit mono) and stores the pixels as .npy under CACHE_DIR; later runs
+    memory-map that file instead of decoding the PNG again.
+
+    Args:
+        fname: Path to the raw PNG
+
+    Returns:
+        2D image array (read-only memmap on cache hits), or None if unreadable
+    """
+    try:
+        st = fname.stat()
+    except OSError:
+        return None
+
+    key = hashlib.sha1(
+        f"{fname.resolve()}|{st.st_size}|{st.st_mtime_ns}".encode()
+    ).hexdigest()[:16]
+    cache_file = CACHE_DIR / f"{fname.stem}_{key}.npy"
+    if cache_file.exists():
+        try:
+            return np.load(cache_file, mmap_mode="r")
+        except ValueError as e:
+            print(f"Ignoring unreadable raw image cache {cache_file}: {e}")
+
+    # Mono 8-bit PNGs skip libpng's color conversion; others keep their depth
+    flags = cv2.IMREAD_GRAYSCALE if png_format(fname) == (8, 0) else cv2.IMREAD_UNCHANGED
+    raw = cv2.imread(str(fname), flags)
+    if raw is None:
+        return None
+
+    with atomic_write(cache_file) as f:
+        np.save(f, raw)
+    return raw
+
 
 def main():
     cwd = Path.cwd()
     print(f"Working directory: {cwd}")
 
     fname = Path("images/raw/JNCE_2022056_40C00036_V01-raw.png")
-    raw = cv2.imread(str(fname), cv2.IMREAD_UNCHANGED)
+    raw = load_raw(fname)
     if raw is None:
         print(f"Could not open raw image: {fname}")
         sys.exit(1)
@@ -22,60 +82,54 @@ def main():
     bandHeight = 128  # strips height for JunoCam visible filters
     bands = 3  # we are using R, G, B (ignoring methane for now)
 
-    # Offsets (assuming first strip is Blue, then Green, then Red)
-    redOffset = 2 * bandHeight
-    greenOffset = bandHeight
-    blueOffset = 0
+    # Filter order within each pushframe (first strip is Blue, then Green, then Red)
+    blueBand, greenBand, redBand = 0, 1, 2
 
     frames = rows // (bandHeight * bands)
     print(f"Frames count: {frames}")
 
-    # Create mosaic per channel
-    redMosaic = np.zeros((frames * bandHeight, width), dtype=raw.dtype)
-    greenMosaic = np.zeros((frames * bandHeight, width), dtype=raw.dtype)
-    blueMosaic = np.zeros((frames * bandHeight, width), dtype=raw.dtype)
-
-    for f in range(1, frames - 1):
-        baseRow = f * bandHeight * bands
+    # View the raw strips as (frame, band, line, column) without copying
+    cube = raw[: frames * bands * bandHeight].reshape(frames, bands, bandHeight, width)
 
-        # Red
-        stripR = raw[baseRow + redOffset : baseRow + redOffset + bandHeight, :]
-        redMosaic[
-            f * bandHeight + bandHeight : (f + 1) * bandHeight + bandHeight, :
-        ] = stripR
+    # Mosaic block offset per channel: red lands one block below its frame,
+    # blue one above. Only frames 1..frames-2 are placed.
+    blockShift = {redBand: 1, greenBand: 0, blueBand: -1}
+    inner = cube[1 : frames - 1]
 
-        # Green
-        stripG = raw[baseRow + greenOffset : baseRow + greenOffset + bandHeight, :]
-        greenMosaic[f * bandHeight : (f + 1) * bandHeight, :] = stripG
+    # Create mosaic per channel with one block copy, viewed as (frame, line, column)
+    mosaics = {}
+    for band, shift in blockShift.items():
+        mosaic = np.zeros((frames * bandHeight, width), dtype=raw.dtype)
+        blocks = mosaic.reshape(frames, bandHeight, width)
+        blocks[1 + shift : 1 + shift + len(inner)] = inner[:, band]
+        mosaics[band] = mosaic
 
-        # Blue
-        stripB = raw[baseRow + blueOffset : baseRow + blueOffset + bandHeight, :]
-        blueMosaic[
-            f * bandHeight - bandHeight : (f + 1) * bandHeight - bandHeight, :
-        ] = stripB
+    redMosaic = mosaics[redBand]
+    greenMosaic = mosaics[greenBand]
+    blueMosaic = mosaics[blueBand]
 
     out_dir = Path("images/processed")
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    cv2.imwrite(str(out_dir / "red_channel.png"), redMosaic)
-    cv2.imwrite(str(out_dir / "green_channel.png"), greenMosaic)
-    cv2.imwrite(str(out_dir / "blue_channel.png"), blueMosaic)
-    print("Single-channel mosaics written.")
+    # Encode the PNGs on worker threads (OpenCV releases the GIL while encoding)
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        channel_writes = [
+            ex.submit(cv2.imwrite, str(out_dir / "red_channel.png"), redMosaic, FAST_PNG_PARAMS),
+            ex.submit(cv2.imwrite, str(out_dir / "green_channel.png"), greenMosaic, FAST_PNG_PARAMS),
+            ex.submit(cv2.imwrite, str(out_dir / "blue_channel.png"), blueMosaic, FAST_PNG_PARAMS),
+        ]
 
-    # Convert to 8-bit if raw type is different (just in case)
-    red8 = cv2.normalize(redMosaic, None, 0, 255, cv2.NORM_MINMAX)
-    green8 = cv2.normalize(greenMosaic, None, 0, 255, cv2.NORM_MINMAX)
-    blue8 = cv2.normalize(blueMosaic, None, 0, 255, cv2.NORM_MINMAX)
+        # Stack into a BGR image (OpenCV order, so Blue first) stretched to 8-bit
+        rgbMosaic = stretch_to_bgr8(blueMosaic, greenMosaic, redMosaic)
 
-    red8 = red8.astype(np.uint8)
-    green8 = green8.astype(np.uint8)
-    blue8 = blue8.astype(np.uint8)
+        combined_write = ex.submit(cv2.imwrite, str(out_dir / "combined_rgb.png"), rgbMosaic)
 
-    # Merge into an RGB image (OpenCV is BGR, so put Blue first)
-    rgbMosaic = cv2.merge([blue8, green8, red8])
+        for write in channel_writes:
+            write.result()
+        print("Single-channel mosaics written.")
 
-    cv2.imwrite(str(out_dir / "combined_rgb.png"), rgbMosaic)
-    print("Combined RGB image written (combined_rgb.png).")
+        combined_write.result()
+        print("Combined RGB image written (combined_rgb.png).")
 
 
 if __name__ == "__main__":
@@ -5,12 +5,99 @@ This version integrates spacecraft motion correction using SPICE kernels.
 """
 
 import cv2
+import hashlib
+import logging
 import numpy as np
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 import sys
-from scipy import ndimage
 
-from spice_correction import SpiceKernelManager, JunoCamImage
+from common import CACHE_DIR, FAST_PNG_PARAMS, atomic_write, stretch_to_bgr8
+
+# spice_correction (spiceypy, numba) is imported inside the functions that
+# need it, so importing this module stays cheap
+
+__all__ = [
+    "base_map",
+    "strip_maps",
+    "shift_strips",
+    "apply_geometric_correction",
+    "cached_pixel_offsets",
+    "process_junocam_with_spice",
+    "main",
+]
+
+
+@lru_cache(maxsize=8)
+def base_map(rows, cols):
+    """
+    Pixel coordinate lookup table shared by every strip of a given size.
+
+    Args:
+        rows: Height of a strip in pixels
+        cols: Width of a strip in pixels
+
+    Returns:
+        Read-only float32 array of shape (rows, cols, 2) holding (x, y)
+    """
+    grid = np.ascontiguousarray(
+        np.indices((rows, cols), dtype=np.float32)[::-1].transpose(1, 2, 0)
+    )
+    grid.setflags(write=False)
+    return grid
+
+
+def strip_maps(rows, cols, dx, dy):
+    """
+    Build cv2.remap coordinate maps for a vertical stack of shifted strips.
+
+    Args:
+        rows: Height of each strip in pixels
+        cols: Width of each strip in pixels
+        dx: Horizontal pixel offset per strip, shape (n_strips,)
+        dy: Vertical pixel offset per strip, shape (n_strips,)
+
+    Returns:
+        Tuple of float32 (map_x, map_y), each of shape (n_strips * rows, cols)
+    """
+    dx = np.asarray(dx, dtype=np.float32)[:, None, None]
+    dy = np.asarray(dy, dtype=np.float32)[:, None, None]
+    n_strips = dx.shape[0]
+
+    grid = base_map(rows, cols)
+    strip_top = (np.arange(n_strips, dtype=np.float32) * rows)[:, None, None]
+
+    # Output pixel samples the source at (x - dx, y - dy) within its strip
+    map_x = (grid[..., 0] - dx).reshape(n_strips * rows, cols)
+    map_y = (grid[..., 1] + strip_top - dy).reshape(n_strips * rows, cols)
+    return map_x, map_y
+
+
+def shift_strips(strips, dx, dy):
+    """
+    Apply geometric correction to a stack of image strips in one pass.
+
+    The strips are treated as one tall image and resampled with a single
+    bilinear cv2.remap, each strip translated by its own (dx, dy). Samples
+    that fall past a strip edge read the neighbouring strip of the stack.
+
+    Args:
+        strips: Stack of strips with shape (n_strips, rows, cols)
+        dx: Horizontal pixel offset per strip, shape (n_strips,)
+        dy: Vertical pixel offset per strip, shape (n_strips,)
+
+    Returns:
+        Corrected stack with the same shape and dtype as strips
+    """
+    n_strips, rows, cols = strips.shape
+    map_x, map_y = strip_maps(rows, cols, dx, dy)
+    tall = np.ascontiguousarray(strips).reshape(n_strips * rows, cols)
+    corrected = cv2.remap(
+        tall, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT
+    )
+    return corrected.reshape(strips.shape)
 
 
 def apply_geometric_correction(strip, dx, dy):
@@ -25,15 +112,58 @@ def apply_geometric_correction(strip, dx, dy):
     Returns:
         Corrected strip
     """
-    # Use affine transformation to shift the image
-    # Create translation matrix
-    rows, cols = strip.shape[:2]
-    M = np.float32([[1, 0, dx], [0, 1, dy]])
+    return shift_strips(strip[np.newaxis], [dx], [dy])[0]
+
+
+def _offsets_cache_key(image_name, kernel_files, band_height, num_frames):
+    """Hash everything the SPICE pixel offsets depend on into a cache key."""
+    import spice_correction
+
+    # Kernel and correction-code mtimes invalidate the cache when either changes
+    sources = sorted(kernel_files) + [spice_correction.__file__]
+    mtimes = "|".join(f"{src}:{Path(src).stat().st_mtime_ns}" for src in sources)
+    key = f"{image_name}|{mtimes}|{band_height}|{num_frames}"
+    return hashlib.sha1(key.encode()).hexdigest()
 
-    # Apply transformation
-    corrected = cv2.warpAffine(strip, M, (cols, rows), flags=cv2.INTER_LINEAR)
 
-    return corrected
+@lru_cache(maxsize=None)
+def cached_pixel_offsets(image_name, kernel_files, band_height, num_frames):
+    """
+    Calculate SPICE pixel offsets, memoized in memory and on disk.
+
+    Args:
+        image_name: JunoCam raw image filename
+        kernel_files: Tuple of furnished kernel paths
+        band_height: Height of each filter band in pixels
+        num_frames: Number of pushframes in the image
+
+    Returns:
+        Per-frame structured pixel offsets as returned by
+        JunoCamImage.calculate_pixel_offsets
+    """
+    from spice_correction import JunoCamImage
+
+    key = _offsets_cache_key(image_name, kernel_files, band_height, num_frames)
+    cache_file = CACHE_DIR / f"offsets_{key}.pkl"
+
+    if cache_file.exists():
+        try:
+            with open(cache_file, "rb") as f:
+                offsets = pickle.load(f)
+            print(f"Using cached SPICE offsets: {cache_file}")
+            return offsets
+        except (EOFError, pickle.UnpicklingError) as e:
+            print(f"Ignoring unreadable SPICE offsets cache {cache_file}: {e}")
+
+    offsets = JunoCamImage(image_name).calculate_pixel_offsets(
+        band_height=band_height,
+        num_frames=num_frames
+    )
+
+    with atomic_write(cache_file) as f:
+        pickle.dump(offsets, f)
+
+    return offsets
 
 
 def process_junocam_with_spice(fname, kernel_manager):
@@ -42,7 +172,7 @@ def process_junocam_with_spice(fname, kernel_manager):
 
     Args:
         fname: Path to raw JunoCam image
-        kernel_manager: Initialized SpiceKernelManager
+        kernel_manager: Initialized SpiceKernelManager, or None to skip correction
 
     Returns:
         Tuple of (red, green, blue) corrected channel mosaics
@@ -65,105 +195,104 @@ def process_junocam_with_spice(fname, kernel_manager):
     frames = rows // (bandHeight * bands)
     print(f"Frames count: {frames}")
 
-    # Initialize SPICE correction
-    junocam_img = JunoCamImage(Path(fname).name)
+    # Get pixel offsets from SPICE (cached per image, kernel set and geometry)
+    use_spice = False
+    pixel_offsets = None
+    if kernel_manager is None:
+        print("SPICE kernels not loaded, skipping correction")
+    else:
+        print("Calculating SPICE-based pixel offsets...")
+        try:
+            pixel_offsets = cached_pixel_offsets(
+                Path(fname).name,
+                tuple(kernel_manager.loaded_kernels),
+                bandHeight,
+                frames
+            )
+            use_spice = True
+            print("SPICE correction enabled")
+        except Exception as e:
+            print(f"Warning: Could not calculate SPICE offsets: {e}")
+            print("Falling back to no correction")
+
+    # Filter order within each pushframe: Blue, Green, Red
+    blueBand, greenBand, redBand = 0, 1, 2
+
+    # View the raw strips as (frame, band, line, column) without copying
+    cube = raw[: frames * bands * bandHeight].reshape(frames, bands, bandHeight, width)
+
+    if use_spice:
+        # Per-strip (dx, dy) in raw band order
+        shifts = np.stack(
+            [pixel_offsets['blue'], pixel_offsets['green'], pixel_offsets['red']], axis=1
+        )
 
-    # Get pixel offsets from SPICE
-    print("Calculating SPICE-based pixel offsets...")
-    try:
-        pixel_offsets = junocam_img.calculate_pixel_offsets(
-            band_height=bandHeight,
-            num_frames=frames
+        # One remap per channel over all of its frames
+        redMosaic, greenMosaic, blueMosaic = (
+            shift_strips(
+                cube[:, band], shifts[:, band, 0], shifts[:, band, 1]
+            ).reshape(frames * bandHeight, width)
+            for band in (redBand, greenBand, blueBand)
         )
-        use_spice = True
-        print("SPICE correction enabled")
-    except Exception as e:
-        print(f"Warning: Could not calculate SPICE offsets: {e}")
-        print("Falling back to no correction")
-        use_spice = False
-        pixel_offsets = None
-
-    # Filter offsets in the raw image
-    # Assuming order: Blue, Green, Red
-    redOffset = 2 * bandHeight
-    greenOffset = bandHeight
-    blueOffset = 0
-
-    # Create output mosaics
-    redMosaic = np.zeros((frames * bandHeight, width), dtype=raw.dtype)
-    greenMosaic = np.zeros((frames * bandHeight, width), dtype=raw.dtype)
-    blueMosaic = np.zeros((frames * bandHeight, width), dtype=raw.dtype)
-
-    # Process each frame
-    for f in range(frames):
-        baseRow = f * bandHeight * bands
-        outRow = f * bandHeight
-
-        # Get SPICE offsets for this frame (if available)
-        if use_spice and f in pixel_offsets:
-            red_dx, red_dy = pixel_offsets[f]['RED']
-            green_dx, green_dy = pixel_offsets[f]['GREEN']
-            blue_dx, blue_dy = pixel_offsets[f]['BLUE']
-        else:
-            # No correction
-            red_dx = red_dy = 0
-            green_dx = green_dy = 0
-            blue_dx = blue_dy = 0
-
-        # Extract strips
-        stripR = raw[baseRow + redOffset : baseRow + redOffset + bandHeight, :]
-        stripG = raw[baseRow + greenOffset : baseRow + greenOffset + bandHeight, :]
-        stripB = raw[baseRow + blueOffset : baseRow + blueOffset + bandHeight, :]
-
-        # Apply geometric correction
-        if use_spice:
-            stripR = apply_geometric_correction(stripR, red_dx, red_dy)
-            stripG = apply_geometric_correction(stripG, green_dx, green_dy)
-            stripB = apply_geometric_correction(stripB, blue_dx, blue_dy)
-
-        # Place into mosaics
-        redMosaic[outRow : outRow + bandHeight, :] = stripR
-        greenMosaic[outRow : outRow + bandHeight, :] = stripG
-        blueMosaic[outRow : outRow + bandHeight, :] = stripB
+    else:
+        # Place into mosaics (frame f occupies mosaic rows f*bandHeight onwards)
+        redMosaic = cube[:, redBand].reshape(frames * bandHeight, width)
+        greenMosaic = cube[:, greenBand].reshape(frames * bandHeight, width)
+        blueMosaic = cube[:, blueBand].reshape(frames * bandHeight, width)
 
     return redMosaic, greenMosaic, blueMosaic
 
 
 def main():
+    from spice_correction import SpiceKernelManager
+
     cwd = Path.cwd()
     print(f"Working directory: {cwd}")
 
     # Initialize SPICE kernels
     kernel_manager = SpiceKernelManager()
-    kernel_manager.load_kernels()
+    try:
+        kernel_manager.load_kernels()
+        correction_kernels = kernel_manager
+    except RuntimeError as e:
+        # e.g. no CK kernel: still write the uncorrected mosaics
+        print(f"Warning: Could not load SPICE kernels: {e}")
+        print("Falling back to no correction")
+        correction_kernels = None
 
     try:
         # Process image
         fname = Path("images/raw/JNCE_2022056_40C00036_V01-raw.png")
 
         redMosaic, greenMosaic, blueMosaic = process_junocam_with_spice(
-            fname, kernel_manager
+            fname, correction_kernels
         )
 
         # Save individual channels
         out_dir = Path("images/processed")
         out_dir.mkdir(parents=True, exist_ok=True)
 
-        cv2.imwrite(str(out_dir / "red_channel_spice.png"), redMosaic)
-        cv2.imwrite(str(out_dir / "green_channel_spice.png"), greenMosaic)
-        cv2.imwrite(str(out_dir / "blue_channel_spice.png"), blueMosaic)
-        print("SPICE-corrected single-channel mosaics written.")
+        # Encode the PNGs on worker threads (OpenCV releases the GIL while encoding)
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            channel_writes = [
+                ex.submit(cv2.imwrite, str(out_dir / "red_channel_spice.png"), redMosaic, FAST_PNG_PARAMS),
+                ex.submit(cv2.imwrite, str(out_dir / "green_channel_spice.png"), greenMosaic, FAST_PNG_PARAMS),
+                ex.submit(cv2.imwrite, str(out_dir / "blue_channel_spice.png"), blueMosaic, FAST_PNG_PARAMS),
+            ]
+
+            # Create RGB composite (OpenCV uses BGR) stretched to 8-bit
+            rgbMosaic = stretch_to_bgr8(blueMosaic, greenMosaic, redMosaic)
 
-        # Create RGB composite
-        red8 = cv2.normalize(redMosaic, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-        green8 = cv2.normalize(greenMosaic, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-        blue8 = cv2.normalize(blueMosaic, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+            combined_write = ex.submit(
+                cv2.imwrite, str(out_dir / "combined_rgb_spice.png"), rgbMosaic
+            )
 
-        # Merge into RGB (OpenCV uses BGR)
-        rgbMosaic = cv2.merge([blue8, green8, red8])
+            for write in channel_writes:
+                write.result()
+            print("SPICE-corrected single-channel mosaics written.")
 
-        cv2.imwrite(str(out_dir / "combined_rgb_spice.png"), rgbMosaic)
-        print("SPICE-corrected combined RGB image written.")
+            combined_write.result()
+            print("SPICE-corrected combined RGB image written.")
 
     finally:
         # Clean up SPICE kernels
@@ -171,4 +300,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Show spice_correction's kernel loading summary alongside our output
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     main()
@@ -5,10 +5,206 @@ This module uses SPICE kernels to calculate the spacecraft motion between
 filter exposures and correct the resulting image misalignment.
 """
 
+import hashlib
+import logging
+import os
+import re
+import tempfile
 import spiceypy as spice
+from spiceypy import cyice
+from spiceypy.utils.exceptions import NotFoundError
 import numpy as np
+from functools import cached_property
 from pathlib import Path
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+log = logging.getLogger(__name__)
+
+
+def _compute_offsets_numpy(states, xforms, dts, pixel_scale):
+    """
+    Convert spacecraft states into per-sample pixel offsets.
+
+    Pure NumPy implementation, used when Numba is not installed.
+
+    Args:
+        states: (N, 6) J2000 state vectors relative to Jupiter (km, km/s)
+        xforms: (N, 6, 6) J2000 to camera frame state transformation matrices
+        dts: (N,) time interval of each sample in seconds
+        pixel_scale: Camera pixel scale in radians/pixel
+
+    Returns:
+        (N, 2) float32 array of (dx, dy) pixel offsets
+    """
+    # Camera frame velocity, integrated over the interval to first order
+    velocity = np.einsum('nij,nj->ni', xforms[:, 3:6, :], states, optimize=True)
+    motion = velocity * dts[:, None]
+
+    # Project motion onto image plane (small angle approximation), scaled by
+    # the spacecraft's distance from Jupiter
+    range_to_jupiter = np.linalg.norm(states[:, :3], axis=1)
+    inv = 1.0 / (range_to_jupiter * pixel_scale)
+    return (motion[:, :2] * inv[:, None]).astype(np.float32)
+
+
+if numba is None:
+    _compute_offsets_kernel = _compute_offsets_numpy
+else:
+    # Compiled eagerly for the contiguous float32 arrays _compute_offsets
+    # passes in; cache=True reuses the machine code across runs
+    @numba.njit(
+        "float32[:, ::1](float32[:, ::1], float32[:, :, ::1], float32[::1], float32)",
+        parallel=True,
+        fastmath=True,
+        cache=True,
+    )
+    def _compute_offsets_kernel(states, xforms, dts, pixel_scale):
+        """Numba version of _compute_offsets_numpy, parallel over samples."""
+        n = states.shape[0]
+        offsets = np.empty((n, 2), dtype=np.float32)
+        inv_scale = np.float32(1.0) / pixel_scale
+        for i in numba.prange(n):
+            # In-plane velocity rows of the state transform applied to the
+            # full state (written out, since Numba's matmul needs SciPy's BLAS)
+            m0 = np.float32(0.0)
+            m1 = np.float32(0.0)
+            for j in range(6):
+                m0 += xforms[i, 3, j] * states[i, j]
+                m1 += xforms[i, 4, j] * states[i, j]
+
+            # Project motion onto image plane (small angle approximation),
+            # scaled by the spacecraft's distance from Jupiter
+            range_to_jupiter = np.sqrt(
+                states[i, 0] * states[i, 0]
+                + states[i, 1] * states[i, 1]
+                + states[i, 2] * states[i, 2]
+            )
+            inv = dts[i] * inv_scale / range_to_jupiter
+            offsets[i, 0] = m0 * inv
+            offsets[i, 1] = m1 * inv
+        return offsets
+
+
+def _compute_offsets(states, xforms, dts, pixel_scale):
+    """
+    Project SPICE states to pixel offsets in single precision.
+
+    SPICE evaluates the ephemeris in float64; the offsets only drive a pixel
+    shift, so the projection itself runs in float32.
+
+    Args:
+        states: (N, 6) J2000 state vectors relative to Jupiter (km, km/s)
+        xforms: (N, 6, 6) J2000 to camera frame state transformation matrices
+        dts: (N,) time interval of each sample in seconds
+        pixel_scale: Camera pixel scale in radians/pixel
+
+    Returns:
+        (N, 2) float32 array of (dx, dy) pixel offsets
+    """
+    return _compute_offsets_kernel(
+        np.ascontiguousarray(states, dtype=np.float32),
+        np.ascontiguousarray(xforms, dtype=np.float32),
+        np.ascontiguousarray(dts, dtype=np.float32),
+        np.float32(pixel_scale),
+    )
+
+
+# JNCE_YYYYDDD_NNNNNNNN_VNN, followed by the product suffix (-raw.png etc.)
+_FN_RE = re.compile(r'JNCE_(?P<year>\d{4})(?P<doy>\d{3})_(?P<id>[0-9A-F]+)_V\d+')
+
+
+def _match_filename(filename):
+    """Match a JunoCam basename against _FN_RE, raising ValueError if it is not one."""
+    m = _FN_RE.match(filename)
+    if m is None:
+        raise ValueError(f"Not a JunoCam filename: {filename}")
+    return m
+
+
+# Generated meta-kernels are cached here
+CACHE_DIR = Path(".cache")
+
+# Longest piece of a meta-kernel string value; SPICE truncates kernel pool
+# strings at 80 characters, so longer values are continued with '+'
+_KPL_STRING_WIDTH = 78
+
+
+def _kpl_string(value, indent):
+    """Quote a meta-kernel string value, splitting it with '+' continuations."""
+    pieces = [
+        value[i:i + _KPL_STRING_WIDTH] for i in range(0, len(value), _KPL_STRING_WIDTH)
+    ] or [""]
+    quoted = [piece.replace("'", "''") for piece in pieces]
+    lines = [f"{indent}'{piece}+'" for piece in quoted[:-1]]
+    lines.append(f"{indent}'{quoted[-1]}'")
+    return "\n".join(lines)
+
+
+def _is_furnished(path):
+    """Whether a kernel file is currently in SPICE's kernel pool."""
+    try:
+        spice.kinfo(path)
+    except NotFoundError:
+        return False
+    return True
+
+
+def write_metakernel(kernel_dir, kernels):
+    """
+    Write a meta-kernel listing the given kernels, reusing a cached copy.
+
+    The file lives under CACHE_DIR, keyed by a hash of its contents, so the
+    kernel directory itself can be read-only. Long paths are split with '+'
+    continuations to stay within SPICE's 80 character string limit.
+
+    Args:
+        kernel_dir: Root kernel directory (becomes the $KERNELS path symbol)
+        kernels: Kernel paths under kernel_dir, in load order
+
+    Returns:
+        Path to the meta-kernel
+    """
+    kernel_dir = Path(kernel_dir)
+    entries = "\n".join(
+        _kpl_string(f"$KERNELS/{Path(k).relative_to(kernel_dir).as_posix()}", " " * 8)
+        for k in kernels
+    )
+    text = (
+        "KPL/MK\n"
+        "\n"
+        "\\begindata\n"
+        "\n"
+        "    PATH_VALUES     = (\n"
+        f"{_kpl_string(kernel_dir.resolve().as_posix(), ' ' * 8)}\n"
+        "    )\n"
+        "    PATH_SYMBOLS    = ( 'KERNELS' )\n"
+        "\n"
+        "    KERNELS_TO_LOAD = (\n"
+        f"{entries}\n"
+        "    )\n"
+        "\n"
+        "\\begintext\n"
+    )
+
+    key = hashlib.sha1(text.encode()).hexdigest()[:16]
+    meta_path = CACHE_DIR / f"juno_kernels_{key}.tm"
+    if not meta_path.exists():
+        # Write to a temporary file first so a partial meta-kernel is never loaded
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix=f"{meta_path.name}.", suffix=".part")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.replace(tmp, meta_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return meta_path
+
 
 class SpiceKernelManager:
     """Manages loading and furnishing SPICE kernels."""
@@ -18,7 +214,13 @@ class SpiceKernelManager:
         self.loaded_kernels = []
 
     def load_kernels(self):
-        """Load all required SPICE kernels."""
+        """
+        Load all required SPICE kernels through a single meta-kernel.
+
+        Kernels are furnished into SPICE's process-wide kernel pool, so a
+        meta-kernel that is still loaded (e.g. by an earlier manager for the
+        same kernel set) is not furnished again.
+        """
         # Define kernel paths - adjust these to match your kernel filenames
         kernels = [
             # Leapseconds kernel (for time conversions)
@@ -44,13 +246,44 @@ class SpiceKernelManager:
             # Example: self.kernel_dir / "ck" / "juno_rec_220101_220401_v01.bc",
         ]
 
-        for kernel in kernels:
-            if kernel.exists():
-                spice.furnsh(str(kernel))
-                self.loaded_kernels.append(str(kernel))
-                print(f"Loaded: {kernel.name}")
+        # List each kernel's directory once rather than stat'ing every kernel
+        present = set()
+        for parent in {kernel.parent for kernel in kernels}:
+            try:
+                with os.scandir(parent) as entries:
+                    present.update(
+                        os.path.join(parent, entry.name) for entry in entries if entry.is_file()
+                    )
+            except OSError:
+                continue
+        found = [kernel for kernel in kernels if str(kernel) in present]
+        missing = [str(kernel) for kernel in kernels if str(kernel) not in present]
+        if missing:
+            log.warning("Kernels not found: %s", ", ".join(missing))
+
+        furnished = None
+        if found:
+            meta_path = str(write_metakernel(self.kernel_dir, found))
+            if _is_furnished(meta_path):
+                log.debug("Already furnished %s", meta_path)
             else:
-                print(f"Warning: Kernel not found: {kernel}")
+                spice.furnsh(meta_path)
+                furnished = meta_path
+                log.debug("Furnished %s: %s", meta_path, ", ".join(str(k) for k in found))
+
+        # The camera frame needs spacecraft orientation, so fail here rather
+        # than computing offsets in the wrong frame later
+        if spice.ktotal('ck') == 0:
+            # Only back out what this call loaded; the pool is shared
+            if furnished is not None:
+                spice.unload(furnished)
+            raise RuntimeError(
+                "No CK (orientation) kernel loaded; add one covering your image "
+                f"date to the kernel list and {self.kernel_dir / 'ck'}"
+            )
+
+        self.loaded_kernels = [str(kernel) for kernel in found]
+        log.info("Loaded %d kernels", len(self.loaded_kernels))
 
     def unload_kernels(self):
         """Unload all SPICE kernels."""
@@ -69,10 +302,23 @@ class JunoCamImage:
     # Filter timing (in seconds, approximate values - adjust based on IK)
     FRAME_TRANSFER_TIME = 0.001  # Time between filter exposures
 
+    # Approximate line time (you should get this from IK kernel)
+    LINE_TIME = 0.0001  # 100 microseconds per line (example)
+
+    # Camera pixel scale
+    # From JunoCam IK: ~400 microradians/pixel (example value)
+    PIXEL_SCALE = 400e-6  # radians/pixel
+
     # Filters are acquired in order: Blue, Green, Red (typically)
     # Each pushframe consists of 3 bands (one per filter)
     FILTER_SEQUENCE = ['BLUE', 'GREEN', 'RED']
 
+    # One record per frame holding each filter's (dx, dy), in FILTER_SEQUENCE order
+    OFFSET_DTYPE = np.dtype([('blue', ('f4', 2)), ('green', ('f4', 2)), ('red', ('f4', 2))])
+
+    # Time offset of each filter from green (reference), in FILTER_SEQUENCE order
+    FILTER_DTS = np.array([-FRAME_TRANSFER_TIME, 0.0, FRAME_TRANSFER_TIME])
+
     def __init__(self, filename):
         """
         Initialize from JunoCam filename.
@@ -86,41 +332,85 @@ class JunoCamImage:
         - NNNNNNNN = image ID (40C00036)
         - VNN = version (V01)
         """
-        self.filename = Path(filename).name
+        self.filename = os.path.basename(filename)
         self.parse_filename()
 
     def parse_filename(self):
         """Extract metadata from JunoCam filename."""
-        parts = self.filename.split('_')
+        m = _match_filename(self.filename)
 
-        # Extract year and day of year
-        year_doy = parts[1]  # "2022056"
-        self.year = int(year_doy[:4])
-        self.doy = int(year_doy[4:])
+        self.year = int(m['year'])
+        self.doy = int(m['doy'])
 
-        # Extract image ID (hexadecimal spacecraft clock count)
-        self.image_id = parts[2]
-
-        # Convert hex image ID to spacecraft clock
         # The image ID is the spacecraft clock count in hexadecimal
+        self.image_id = m['id']
         self.sclk_count = int(self.image_id, 16)
 
         # Convert to string format for SPICE
-        self.sclk_string = f"-61/{self.sclk_count}"
+        self.sclk_string = self.sclk_string_for(self.sclk_count)
 
-        print(f"Parsed: Year={self.year}, DOY={self.doy}, SCLK={self.sclk_string}")
+        log.debug("Parsed: Year=%d, DOY=%d, SCLK=%s", self.year, self.doy, self.sclk_string)
 
-    def get_ephemeris_time(self):
-        """Convert spacecraft clock to ephemeris time."""
+    @cached_property
+    def ephemeris_time(self):
+        """Ephemeris time of the spacecraft clock, converted once per image."""
+        return self._sclk_to_et()
+
+    def _sclk_to_et(self, warn=True):
+        """
+        Convert the spacecraft clock to ephemeris time.
+
+        Falls back to the start of the image's day if the clock can't be
+        converted (e.g. no SCLK kernel covers it).
+
+        Args:
+            warn: Log a warning when falling back
+
+        Returns:
+            Ephemeris time
+        """
         try:
             et = spice.scs2e(self.JUNO_ID, self.sclk_string)
             return et
         except Exception as e:
-            print(f"Error converting SCLK to ET: {e}")
+            if warn:
+                log.warning("Error converting SCLK to ET: %s", e)
             # Fallback: convert from calendar time
             utc = f"{self.year}-{self.doy:03d}T00:00:00"
             return spice.str2et(utc)
 
+    def get_ephemeris_time(self):
+        """Convert spacecraft clock to ephemeris time."""
+        return self.ephemeris_time
+
+    @classmethod
+    def sclk_string_for(cls, sclk_count):
+        """SPICE spacecraft clock string for a Juno clock count."""
+        return f"{cls.JUNO_ID}/{sclk_count}"
+
+    @classmethod
+    def ephemeris_times_for(cls, filenames):
+        """
+        Convert the spacecraft clocks of many images to ephemeris times at once.
+
+        Args:
+            filenames: Iterable of JunoCam filenames
+
+        Returns:
+            Array of ephemeris times, one per filename
+        """
+        filenames = list(filenames)
+        sclk_strings = np.array([
+            cls.sclk_string_for(int(_match_filename(os.path.basename(f))['id'], 16))
+            for f in filenames
+        ])
+        try:
+            return cyice.scs2e_v(cls.JUNO_ID, sclk_strings)
+        except Exception as e:
+            log.warning("Error converting SCLK to ET, converting images one by one: %s", e)
+            # Fall back to converting each image on its own, warning only once
+            return np.array([cls(f)._sclk_to_et(warn=False) for f in filenames])
+
     def calculate_motion_vector(self, et_start, dt):
         """
         Calculate spacecraft motion vector during time interval.
@@ -132,95 +422,114 @@ class JunoCamImage:
         Returns:
             Motion vector in JunoCam frame (pixels/second estimated)
         """
-        et_end = et_start + dt
+        # Spacecraft state relative to Jupiter in J2000 frame
+        state, _ = spice.spkezr("JUNO", et_start, "J2000", "NONE", "JUPITER")
 
-        # Get spacecraft position and velocity at both times
-        # Relative to Jupiter in J2000 frame
-        state_start, _ = spice.spkezr("JUNO", et_start, "J2000", "NONE", "JUPITER")
-        state_end, _ = spice.spkezr("JUNO", et_end, "J2000", "NONE", "JUPITER")
+        # Transform the full state into the camera frame; the velocity half
+        # times dt is the displacement to first order
+        state_cam = self.camera_state_transform(et_start) @ state
+        return state_cam[3:6] * dt
 
-        # Extract positions (first 3 components)
-        pos_start = state_start[:3]
-        pos_end = state_end[:3]
+    def camera_state_transform(self, et):
+        """
+        Get the J2000 to JunoCam state transformation matrix at an ephemeris time.
 
-        # Calculate displacement
-        displacement = pos_end - pos_start
+        Args:
+            et: Ephemeris time
 
+        Returns:
+            6x6 state transformation matrix
+        """
         # Get spacecraft pointing (C-matrix) to transform to camera frame
-        # This requires the CK kernel
-        try:
-            rotation_matrix = spice.pxform("J2000", "JUNO_JUNOCAM", et_start)
-            camera_displacement = rotation_matrix @ displacement
-        except Exception as e:
-            print(f"Warning: Could not get camera frame transformation: {e}")
-            camera_displacement = displacement
+        # This requires the CK kernel, checked for in load_kernels
+        return spice.sxform("J2000", "JUNO_JUNOCAM", et)
+
+    def camera_state_transforms(self, ets):
+        """
+        Get J2000 to JunoCam state transformation matrices for an array of times.
 
-        return camera_displacement
+        Args:
+            ets: 1-D array of ephemeris times
+
+        Returns:
+            (N, 6, 6) state transformation matrices
+        """
+        return cyice.sxform_v("J2000", "JUNO_JUNOCAM", ets)
 
-    def calculate_pixel_offsets(self, band_height=128, num_frames=None):
+    def calculate_pixel_offsets(self, band_height=128, num_frames=None, symmetric=True):
         """
         Calculate per-frame pixel offsets for geometric correction.
 
         Args:
             band_height: Height of each filter band in pixels
             num_frames: Number of pushframes in the image
+            symmetric: If True, compute one motion step per frame and mirror it
+                for the filters before and after green (first order). If False,
+                evaluate every filter at the midpoint of its own interval, which
+                keeps second-order terms at three times the SPICE calls.
 
         Returns:
-            Dictionary mapping frame index to (dx, dy) pixel offsets for each filter
+            Structured array of OFFSET_DTYPE records, one per frame, so that
+            offsets[frame_idx]['red'] is that frame's red (dx, dy)
         """
-        et_base = self.get_ephemeris_time()
-
-        offsets = {}
+        et_base = self.ephemeris_time
 
         if num_frames is None:
             # You'll need to determine this from the image
             num_frames = 30  # example
 
-        # For each pushframe
-        for frame_idx in range(num_frames):
-            # Calculate time for this frame
-            # Each pushframe takes ~band_height * line_time
-            # Approximate line time (you should get this from IK kernel)
-            line_time = 0.0001  # 100 microseconds per line (example)
-            frame_time = frame_idx * band_height * 3 * line_time
-
-            et_frame = et_base + frame_time
-
-            frame_offsets = {}
-
-            # Calculate offset for each filter relative to green (reference)
-            for filter_idx, filter_name in enumerate(self.FILTER_SEQUENCE):
-                # Time offset from green filter
-                if filter_name == 'GREEN':
-                    dt = 0.0
-                elif filter_name == 'BLUE':
-                    dt = -self.FRAME_TRANSFER_TIME
-                else:  # RED
-                    dt = self.FRAME_TRANSFER_TIME
-
-                # Calculate motion during this time
-                motion = self.calculate_motion_vector(et_frame, dt)
-
-                # Convert motion to pixel offsets
-                # This requires knowing the camera's pixel scale
-                # From JunoCam IK: ~400 microradians/pixel (example value)
-                pixel_scale = 400e-6  # radians/pixel
-
-                # Project motion onto image plane
-                # This is simplified - real calculation requires full geometry
-                # For now, assume small angles
-                range_to_jupiter = np.linalg.norm(motion)
-                if range_to_jupiter > 0:
-                    dx = motion[0] / (range_to_jupiter * pixel_scale)
-                    dy = motion[1] / (range_to_jupiter * pixel_scale)
-                else:
-                    dx, dy = 0, 0
-
-                frame_offsets[filter_name] = (dx, dy)
-
-            offsets[frame_idx] = frame_offsets
+        # Calculate time for each frame
+        # Each pushframe takes ~band_height * line_time
+        et_frames = et_base + np.arange(num_frames) * (band_height * 3 * self.LINE_TIME)
+        pixel_scale = self.PIXEL_SCALE
+        dts = self.FILTER_DTS
+        num_filters = len(dts)
+
+        if symmetric:
+            # To first order the blue and red displacements are equal and
+            # opposite about green, so project a single FRAME_TRANSFER_TIME step
+            # per frame and scale it by each filter's signed offset
+            states, _ = cyice.spkezr_v("JUNO", et_frames, "J2000", "NONE", "JUPITER")
+            xforms = self.camera_state_transforms(et_frames)
+            step = _compute_offsets(
+                states, xforms, np.full(num_frames, self.FRAME_TRANSFER_TIME), pixel_scale
+            )
+            signs = (dts / self.FRAME_TRANSFER_TIME).astype(np.float32)
+            pixel_offsets = step[:, None, :] * signs[None, :, None]
+        else:
+            # One sample per (frame, filter) pair, flattened frame-major, with
+            # the state taken at the midpoint of each filter's interval
+            et_mid = (et_frames[:, None] + dts[None, :] / 2).ravel()
+            states, _ = cyice.spkezr_v("JUNO", et_mid, "J2000", "NONE", "JUPITER")
+            xforms = self.camera_state_transforms(et_mid)
+
+            # Project all samples onto the image plane at once
+            pixel_offsets = _compute_offsets(
+                states, xforms, np.tile(dts, num_frames), pixel_scale
+            )
+
+        # Reinterpret each frame's contiguous (filter, axis) block as one record
+        pixel_offsets = pixel_offsets.reshape(num_frames, num_filters * 2)
+        return pixel_offsets.view(self.OFFSET_DTYPE)[:, 0]
+
+    @classmethod
+    def offsets_as_dict(cls, offsets):
+        """
+        Convert an offsets array to the older nested dictionary layout.
 
-        return offsets
+        Args:
+            offsets: Structured array from calculate_pixel_offsets
+
+        Returns:
+            Dictionary mapping frame index to (dx, dy) pixel offsets for each filter
+        """
+        return {
+            frame_idx: {
+                filter_name: tuple(float(v) for v in offsets[frame_idx][filter_name.lower()])
+                for filter_name in cls.FILTER_SEQUENCE
+            }
+            for frame_idx in range(len(offsets))
+        }
 
 
 def example_usage():
@@ -254,4 +563,5 @@ def example_usage():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     example_usage()